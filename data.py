@@ -6,7 +6,7 @@ Google Antigravity AIOps Agent - Data Module (Optimized Final)
 import json
 import os
 import logging
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
 from dataclasses import dataclass, field
 
 # =====================================================
@@ -22,6 +22,10 @@ class TopologyConstants:
     DEFAULT_LAYER = 99
     DEFAULT_TYPE = "UNKNOWN"
     MAX_LAYER = 100
+    
+    # 因果推論の分岐種別（NetworkNode.analysis_kind のビットフラグ）
+    ANALYSIS_REDUNDANT = 1
+    ANALYSIS_HAS_PARENT = 2
 
 # =====================================================
 # データクラス定義
@@ -35,6 +39,7 @@ class NetworkNode:
     parent_id: Optional[str] = None
     redundancy_group: Optional[str] = None
     metadata: Dict[str, Any] = field(default_factory=dict)
+    analysis_kind: int = field(init=False, repr=False, compare=False)
     
     def __post_init__(self):
         """データ検証"""
@@ -53,6 +58,12 @@ class NetworkNode:
         if not isinstance(self.metadata, dict):
             logger.warning(f"Node {self.id}: metadata must be dict, resetting")
             self.metadata = {}
+        
+        # 推論時の分岐を構築時に確定
+        self.analysis_kind = (
+            (TopologyConstants.ANALYSIS_REDUNDANT if self.redundancy_group else 0)
+            | (TopologyConstants.ANALYSIS_HAS_PARENT if self.parent_id else 0)
+        )
 
     def get_metadata(self, key: str, default: Any = None) -> Any:
         return self.metadata.get(key, default)
@@ -176,7 +187,19 @@ def _has_circular_reference(node: NetworkNode, topology: Dict[str, NetworkNode],
         return _has_circular_reference(parent, topology, visited)
     return False
 
+# =====================================================
+# トポロジー索引
+# =====================================================
+def build_children_index(topology: Dict[str, NetworkNode]) -> Dict[str, List[NetworkNode]]:
+    """親ID -> 子ノード一覧の索引を構築（親子探索時の全ノード走査を回避）"""
+    children_by_parent: Dict[str, List[NetworkNode]] = {}
+    for node in topology.values():
+        if node.parent_id:
+            children_by_parent.setdefault(node.parent_id, []).append(node)
+    return children_by_parent
+
 # =====================================================
 # グローバル変数
 # =====================================================
 TOPOLOGY = load_topology_from_json()
+TOPOLOGY_CHILDREN = build_children_index(TOPOLOGY)
@@ -5,9 +5,10 @@ Google Antigravity AIOps Agent - Logic Module (Optimized Final)
 """
 
 import logging
-from typing import List, Dict, Set, Optional
+from collections import defaultdict
+from typing import AbstractSet, List, Dict, Optional
 from dataclasses import dataclass, field
-from data import TOPOLOGY, NetworkNode
+from data import TOPOLOGY, TOPOLOGY_CHILDREN, NetworkNode, build_children_index
 
 # =====================================================
 # ロギング設定
@@ -18,7 +19,7 @@ logger = logging.getLogger(__name__)
 # データクラス定義
 # =====================================================
 
-@dataclass
+@dataclass(slots=True)
 class Alarm:
     """
     ネットワークアラームを表現するデータクラス
@@ -41,7 +42,7 @@ class Alarm:
         if not self.device_id or not isinstance(self.device_id, str):
             raise ValueError(f"Invalid device_id: {self.device_id}")
 
-@dataclass
+@dataclass(slots=True)
 class InferenceResult:
     """
     因果推論の結果を表現するデータクラス
@@ -76,6 +77,17 @@ class CausalInferenceEngine:
             raise ValueError("Topology cannot be empty")
         
         self.topology = topology
+        
+        # トポロジー索引の事前構築（アラーム分析毎の全ノード走査を回避）
+        self.by_redundancy_group: Dict[str, List[NetworkNode]] = defaultdict(list)
+        for node in topology.values():
+            if node.redundancy_group:
+                self.by_redundancy_group[node.redundancy_group].append(node)
+        self.by_parent: Dict[str, List[NetworkNode]] = build_children_index(topology)
+        self.group_size: Dict[str, int] = {
+            group: len(members) for group, members in self.by_redundancy_group.items()
+        }
+        
         logger.info(f"CausalInferenceEngine initialized with {len(topology)} nodes")
     
     def analyze_alarms(self, alarms: List[Alarm]) -> InferenceResult:
@@ -96,12 +108,12 @@ class CausalInferenceEngine:
                 severity="INFO"
             )
         
-        # アラーム情報の整理
-        alarmed_device_ids = {a.device_id for a in alarms}
+        # アラーム情報の整理（キーのビューをアラーム発生デバイスIDの集合として使う）
         alarm_map = {a.device_id: a for a in alarms}
+        alarmed_device_ids = alarm_map.keys()
         
-        # 階層順にソート（layer値が小さいほど上位層）
-        sorted_alarms = sorted(
+        # 最上位層のアラームを選択（layer値が小さいほど上位層）
+        top_alarm = min(
             alarms,
             key=lambda a: (
                 self.topology[a.device_id].layer 
@@ -109,8 +121,6 @@ class CausalInferenceEngine:
                 else 999
             )
         )
-        
-        top_alarm = sorted_alarms[0]
         top_node = self.topology.get(top_alarm.device_id)
         
         # トポロジーに存在しないデバイス
@@ -124,56 +134,64 @@ class CausalInferenceEngine:
                 severity="UNKNOWN"
             )
         
-        # A. 冗長性ルール（HA構成の分析）
-        if top_node.redundancy_group:
-            return self._analyze_redundancy(top_node, alarmed_device_ids, alarms, alarm_map)
-        
-        # B. サイレント障害推論
-        if top_node.parent_id:
-            silent_res = self._check_silent_failure_for_parent(
-                top_node.parent_id, 
-                alarmed_device_ids
-            )
-            if silent_res:
-                return silent_res
-        
-        # C. 単一機器障害
-        root_severity = top_alarm.severity
-        
+        # 分岐種別（冗長グループ所属 / 親あり）に応じたルールへディスパッチ
+        handler = self._HANDLERS[top_node.analysis_kind]
+        return handler(self, top_node, top_alarm, alarmed_device_ids, alarms, alarm_map)
+    
+    def _analyze_single_failure(
+        self, 
+        node: NetworkNode, 
+        top_alarm: Alarm, 
+        alarmed_ids: AbstractSet[str], 
+        alarms: List[Alarm], 
+        alarm_map: Dict[str, Alarm]
+    ) -> InferenceResult:
+        """C. 単一機器障害"""
         return InferenceResult(
-            root_cause_node=top_node,
+            root_cause_node=node,
             root_cause_reason=(
-                f"階層ルール: 最上位レイヤーのデバイス {top_node.id} でアラーム検知 "
+                f"階層ルール: 最上位レイヤーのデバイス {node.id} でアラーム検知 "
                 f"({top_alarm.message})"
             ),
             sop_key="HIERARCHY_FAILURE",
             related_alarms=alarms,
-            severity=root_severity
+            severity=top_alarm.severity
         )
     
+    def _analyze_child_failure(
+        self, 
+        node: NetworkNode, 
+        top_alarm: Alarm, 
+        alarmed_ids: AbstractSet[str], 
+        alarms: List[Alarm], 
+        alarm_map: Dict[str, Alarm]
+    ) -> InferenceResult:
+        """B. サイレント障害推論（該当しなければ単一機器障害）"""
+        silent_res = self._check_silent_failure_for_parent(node.parent_id, alarmed_ids)
+        if silent_res:
+            return silent_res
+        return self._analyze_single_failure(node, top_alarm, alarmed_ids, alarms, alarm_map)
+    
     def _analyze_redundancy(
         self, 
         node: NetworkNode, 
-        alarmed_ids: Set[str], 
+        top_alarm: Alarm, 
+        alarmed_ids: AbstractSet[str], 
         alarms: List[Alarm], 
         alarm_map: Dict[str, Alarm]
     ) -> InferenceResult:
-        """冗長性構成（HA）の分析"""
-        group_members = [
-            n for n in self.topology.values() 
-            if n.redundancy_group == node.redundancy_group
-        ]
-        down_members = [n for n in group_members if n.id in alarmed_ids]
+        """A. 冗長性構成（HA）の分析"""
+        group_members = self.by_redundancy_group.get(node.redundancy_group, [])
         
-        # エラー詳細の構築
-        error_details = []
-        for m in down_members:
-            if m.id in alarm_map:
-                error_details.append(f"{m.id}: {alarm_map[m.id].message}")
+        # 停止メンバーのエラー詳細を1回の走査で構築（alarm_map のキー = 停止デバイス）
+        error_details = [
+            f"{m.id}: {alarm_map[m.id].message}"
+            for m in group_members if m.id in alarm_map
+        ]
         details_str = ", ".join(error_details)
         
         # 全停止判定
-        if len(down_members) == len(group_members):
+        if len(error_details) == self.group_size.get(node.redundancy_group, 0):
             return InferenceResult(
                 root_cause_node=node,
                 root_cause_reason=(
@@ -200,34 +218,64 @@ class CausalInferenceEngine:
     def _check_silent_failure_for_parent(
         self, 
         parent_id: str, 
-        alarmed_ids: Set[str]
+        alarmed_ids: AbstractSet[str]
     ) -> Optional[InferenceResult]:
         """サイレント障害の検出"""
         parent_node = self.topology.get(parent_id)
         if not parent_node: return None
         
-        children = [n for n in self.topology.values() if n.parent_id == parent_id]
+        children = self.by_parent.get(parent_id, ())
         if not children: return None
         
-        children_down = sum(1 for c in children if c.id in alarmed_ids)
+        # 稼働中の子が1台でも見つかればサイレント障害ではない
+        for c in children:
+            if c.id not in alarmed_ids:
+                return None
         
-        if children_down == len(children):
-            return InferenceResult(
-                root_cause_node=parent_node,
-                root_cause_reason=(
-                    f"サイレント障害推論: 親デバイス {parent_id} は沈黙していますが、"
-                    f"配下の子デバイスが全滅しています。"
-                ),
-                sop_key="SILENT_FAILURE",
-                related_alarms=[],
-                severity="CRITICAL"
-            )
-        return None
+        return InferenceResult(
+            root_cause_node=parent_node,
+            root_cause_reason=(
+                f"サイレント障害推論: 親デバイス {parent_id} は沈黙していますが、"
+                f"配下の子デバイスが全滅しています。"
+            ),
+            sop_key="SILENT_FAILURE",
+            related_alarms=[],
+            severity="CRITICAL"
+        )
+    
+    # analysis_kind -> 分析ハンドラ（冗長グループ所属は親の有無に関わらず冗長性ルールを優先）
+    _HANDLERS = (
+        _analyze_single_failure,  # 0: 親なし・冗長なし
+        _analyze_redundancy,      # 1: 冗長グループ所属
+        _analyze_child_failure,   # 2: 親あり
+        _analyze_redundancy,      # 3: 冗長グループ所属・親あり
+    )
 
 # =====================================================
 # ユーティリティ関数
 # =====================================================
 
+def _cascade_order(
+    children_by_parent: Dict[str, List[NetworkNode]], 
+    root_cause_id: str
+) -> List[str]:
+    """根本原因から到達できる配下デバイスIDを階層(レイヤー)順に返す"""
+    order = []
+    frontier = [root_cause_id]
+    processed = {root_cause_id}
+    
+    while frontier:
+        next_frontier = []
+        for current_parent_id in frontier:
+            for child in children_by_parent.get(current_parent_id, ()):
+                if child.id not in processed:
+                    processed.add(child.id)
+                    next_frontier.append(child.id)
+        order.extend(next_frontier)
+        frontier = next_frontier
+    
+    return order
+
 def simulate_cascade_failure(
     root_cause_id: str, 
     topology: Dict[str, NetworkNode], 
@@ -237,30 +285,21 @@ def simulate_cascade_failure(
     if root_cause_id not in topology:
         raise ValueError(f"Device {root_cause_id} not found in topology")
     
-    generated_alarms = []
+    # 親ID -> 子ノードの索引（グローバルトポロジーはロード時に構築済みの索引を使う）
+    if topology is TOPOLOGY:
+        children_by_parent = TOPOLOGY_CHILDREN
+    else:
+        children_by_parent = build_children_index(topology)
     
-    # 根本原因のアラーム生成
-    root_alarm = Alarm(root_cause_id, custom_message, "CRITICAL")
-    generated_alarms.append(root_alarm)
+    # 探索はデバイスIDのみで行い、アラームは最後にまとめて生成
+    affected_ids = _cascade_order(children_by_parent, root_cause_id)
     
-    # BFSで子デバイスを探索
-    queue = [root_cause_id]
-    processed = {root_cause_id}
+    # 根本原因のアラーム生成
+    generated_alarms = [Alarm(root_cause_id, custom_message, "CRITICAL")]
+    generated_alarms.extend(
+        Alarm(child_id, "Unreachable", "WARNING") for child_id in affected_ids
+    )
     
-    while queue:
-        current_parent_id = queue.pop(0)
-        children = [
-            n for n in topology.values() 
-            if n.parent_id == current_parent_id
-        ]
-        
-        for child in children:
-            if child.id not in processed:
-                child_alarm = Alarm(child.id, "Unreachable", "WARNING")
-                generated_alarms.append(child_alarm)
-                queue.append(child.id)
-                processed.add(child.id)
-                
     return generated_alarms
 
 # =====================================================
@@ -3,11 +3,15 @@ Google Antigravity AIOps Agent - Network Operations Module (Optimized)
 """
 import re
 import os
+import atexit
+import functools
+import threading
+import contextlib
 import time
 import logging
 import google.generativeai as genai
-from netmiko import ConnectHandler
-from typing import Optional
+from netmiko import BaseConnection, ConnectHandler
+from typing import Dict, Optional, Tuple
 
 # ロギング設定
 logging.basicConfig(level=logging.INFO)
@@ -25,34 +29,158 @@ SANDBOX_DEVICE = {
     'global_delay_factor': 2,
     'banner_timeout': 30,
     'conn_timeout': 30,
+    'keepalive': 30,  # プール内の待機中セッションを維持するSSH keepalive間隔(秒)
 }
 
+# Live診断ログのコマンド区切り
+_SEP = "\n" + "=" * 30 + "\n[Command] "
+
+# =====================================================
+# SSH接続プール
+# =====================================================
+_SSH_POOL: Dict[Tuple, BaseConnection] = {}
+_SSH_LOCKS: Dict[Tuple, threading.Lock] = {}
+_SSH_POOL_LOCK = threading.Lock()
+
+def _ssh_pool_key(device: dict) -> Tuple:
+    # 認証情報(パスワード)はキーに含めない
+    return (device.get('device_type'), device.get('host'), device.get('port'), device.get('username'))
+
+def _disconnect_quietly(ssh: BaseConnection) -> None:
+    try:
+        ssh.disconnect()
+    except Exception as e:
+        logger.warning(f"Failed to close SSH session: {e}")
+
+@contextlib.contextmanager
+def _get_ssh(device: dict):
+    """
+    機器ごとにSSHセッションを再利用する
+    
+    同一機器への同時操作は機器単位のロックで直列化する。未接続または
+    切断済みの場合のみ再接続し、操作中に例外が出たセッションは破棄する。
+    """
+    key = _ssh_pool_key(device)
+    with _SSH_POOL_LOCK:
+        device_lock = _SSH_LOCKS.setdefault(key, threading.Lock())
+    
+    with device_lock:
+        ssh = _SSH_POOL.get(key)
+        if ssh is None or not ssh.is_alive():
+            if ssh is not None:
+                _disconnect_quietly(ssh)
+            ssh = ConnectHandler(**device)
+            try:
+                if not ssh.check_enable_mode(): ssh.enable()
+            except Exception:
+                # プール登録前に失敗したセッションはここで閉じる
+                _disconnect_quietly(ssh)
+                with _SSH_POOL_LOCK:
+                    _SSH_POOL.pop(key, None)
+                raise
+            with _SSH_POOL_LOCK:
+                _SSH_POOL[key] = ssh
+        try:
+            yield ssh
+        except Exception:
+            with _SSH_POOL_LOCK:
+                _SSH_POOL.pop(key, None)
+            _disconnect_quietly(ssh)
+            raise
+
+def _close_all_ssh() -> None:
+    with _SSH_POOL_LOCK:
+        for ssh in _SSH_POOL.values():
+            _disconnect_quietly(ssh)
+        _SSH_POOL.clear()
+
+atexit.register(_close_all_ssh)
+
 # =====================================================
 # 拡張版セキュリティマスキング
 # =====================================================
-def sanitize_output(text: str) -> str:
-    rules = [
-        (r'(password|secret)\s+\d+\s+\S+', r'\1 <HIDDEN_PASSWORD>', re.IGNORECASE),
-        (r'(encrypted password)\s+\S+', r'\1 <HIDDEN_PASSWORD>', re.IGNORECASE),
-        (r'(username \S+ privilege \d+ secret \d+)\s+\S+', r'\1 <HIDDEN_SECRET>', re.IGNORECASE),
-        (r'(snmp-server community)\s+\S+', r'\1 <HIDDEN_COMMUNITY>', re.IGNORECASE),
-        (r'(api[_-]?key|token|bearer)\s*[:=]\s*[\w\-\.]+', r'\1=<MASKED_TOKEN>', re.IGNORECASE),
-        (r'(authorization:\s*bearer)\s+[\w\-\.]+', r'\1 <MASKED_TOKEN>', re.IGNORECASE),
-        (r'(x-api-key:\s*)[\w\-\.]+', r'\1<MASKED_TOKEN>', re.IGNORECASE),
-        (r'(serial\s*(?:number)?|sn)\s*[:=]\s*[\w\-]+', r'\1=<MASKED_SERIAL>', re.IGNORECASE),
-        # IPv4 Public IP Masking (Private IPs 10./172./192. are preserved)
-        (r'\b(?!(?:10|127|172\.(?:1[6-9]|2\d|3[01])|192\.168)\.)(?:(?:25[0-5]|2[0-4]\d|1\d{2}|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d{2}|[1-9]?\d)\b', '<MASKED_PUBLIC_IP>', 0),
-        # IPv6 Masking
-        (r'(?:[0-9a-fA-F]{1,4}:){7}[0-9a-fA-F]{1,4}', '<MASKED_IPV6>', 0),
-        (r'::(?:[0-9a-fA-F]{1,4}:){0,6}[0-9a-fA-F]{1,4}', '<MASKED_IPV6>', 0),
-        # MAC Address
-        (r'([0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2}', '<MASKED_MAC>', 0),
-        (r'([0-9A-Fa-f]{4}\.){2}[0-9A-Fa-f]{4}', '<MASKED_MAC>', 0),
-    ]
+def _mask_public_ipv4(regex: re.Pattern, text: str) -> str:
+    """
+    プライベート/ループバック帯 (10/8, 127/8, 172.16/12, 192.168/16) 以外のIPv4をマスク
+    
+    私設アドレスのマッチは残し、その1文字後ろから再走査する。否定先読みと同じく
+    "10.8.8.8.8" のような連続した数字列でも後続の "8.8.8.8" をマスクできる。
+    """
+    parts = []
+    pos = 0
+    m = regex.search(text)
+    while m:
+        first, second, _ = m.group().split(".", 2)
+        a, b = int(first), int(second)
+        if a == 10 or a == 127 or (a == 172 and 16 <= b <= 31) or (a == 192 and b == 168):
+            m = regex.search(text, m.start() + 1)
+            continue
+        parts.append(text[pos:m.start()])
+        parts.append("<MASKED_PUBLIC_IP>")
+        pos = m.end()
+        m = regex.search(text, pos)
+    if not parts:
+        return text
+    parts.append(text[pos:])
+    return "".join(parts)
+
+_SANITIZE_RULES = (
+    (r'(password|secret)\s+\d+\s+\S+', r'\1 <HIDDEN_PASSWORD>', re.IGNORECASE),
+    (r'(encrypted password)\s+\S+', r'\1 <HIDDEN_PASSWORD>', re.IGNORECASE),
+    (r'(username \S+ privilege \d+ secret \d+)\s+\S+', r'\1 <HIDDEN_SECRET>', re.IGNORECASE),
+    (r'(snmp-server community)\s+\S+', r'\1 <HIDDEN_COMMUNITY>', re.IGNORECASE),
+    (r'(api[_-]?key|token|bearer)\s*[:=]\s*[\w\-\.]+', r'\1=<MASKED_TOKEN>', re.IGNORECASE),
+    (r'(authorization:\s*bearer)\s+[\w\-\.]+', r'\1 <MASKED_TOKEN>', re.IGNORECASE),
+    (r'(x-api-key:\s*)[\w\-\.]+', r'\1<MASKED_TOKEN>', re.IGNORECASE),
+    (r'(serial\s*(?:number)?|sn)\s*[:=]\s*[\w\-]+', r'\1=<MASKED_SERIAL>', re.IGNORECASE),
+    # IPv4 Public IP Masking (Private IPs 10./172./192. are preserved)
+    # (私設アドレスの除外は否定先読みではなく、マッチ後に整数比較で判定する)
+    (r'\b(?:(?:25[0-5]|2[0-4]\d|1\d{2}|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d{2}|[1-9]?\d)\b', _mask_public_ipv4, 0),
+    # IPv6 Masking
+    (r'(?:[0-9a-fA-F]{1,4}:){7}[0-9a-fA-F]{1,4}', '<MASKED_IPV6>', 0),
+    (r'::(?:[0-9a-fA-F]{1,4}:){0,6}[0-9a-fA-F]{1,4}', '<MASKED_IPV6>', 0),
+    # MAC Address
+    (r'([0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2}', '<MASKED_MAC>', 0),
+    (r'([0-9A-Fa-f]{4}\.){2}[0-9A-Fa-f]{4}', '<MASKED_MAC>', 0),
+)
+
+def _compile_sanitize_rules(rules):
+    """
+    各ルールを事前にコンパイルし、優先順に適用する置換処理の列を作る
     
+    1つの正規表現に融合すると最も左のマッチが優先されてマスキング漏れを招くため、
+    ルールは優先順に1つずつ適用する。後方参照の置換文字列は事前に関数へ変換しておく。
+    """
+    steps = []
     for pattern, replacement, flags in rules:
-        text = re.sub(pattern, replacement, text, flags=flags)
+        regex = re.compile(pattern, flags)
+        if callable(replacement):
+            # 関数が指定されたルールは (正規表現, テキスト) を受け取り自前で走査する
+            step = functools.partial(replacement, regex)
+        elif backref := re.fullmatch(r'\\(\d+)(.*)', replacement, re.DOTALL):
+            group, literal = int(backref.group(1)), backref.group(2)
+            step = functools.partial(regex.sub, lambda m, group=group, literal=literal: m.group(group) + literal)
+        elif '\\' in replacement:
+            raise ValueError(f"Unsupported replacement template: {replacement}")
+        else:
+            step = functools.partial(regex.sub, replacement)
+        steps.append(step)
+    return tuple(steps)
+
+_SANITIZE_STEPS = _compile_sanitize_rules(_SANITIZE_RULES)
+
+# いずれかのルールにマッチするテキストが必ず含む文字列（どれも無ければ正規表現を省略）
+_SANITIZE_HINT_CHARS = (".", ":", "=", "-")
+_SANITIZE_HINT_WORDS = ("password", "secret", "community")
+
+def sanitize_output(text: str) -> str:
+    if not any(h in text for h in _SANITIZE_HINT_CHARS):
+        lowered = text.lower()
+        if not any(h in lowered for h in _SANITIZE_HINT_WORDS):
+            return text
     
+    for step in _SANITIZE_STEPS:
+        text = step(text)
     return text
 
 # =====================================================
@@ -60,7 +188,7 @@ def sanitize_output(text: str) -> str:
 # =====================================================
 class AIModelManager:
     _instance = None
-    _model = None
+    _models = None
     _api_key = None
     
     def __new__(cls):
@@ -68,67 +196,87 @@ class AIModelManager:
             cls._instance = super().__new__(cls)
         return cls._instance
     
-    def get_model(self, api_key: str, model_name: str = "gemma-3-12b-it"):
+    def get_model(self, api_key: str, model_name: str = "gemma-3-12b-it", temperature: float = 0.0):
+        """
+        (モデル名, 温度) ごとに生成済みモデルを再利用する
+        
+        GenerativeModel は初回の生成呼び出し時に genai.configure のグローバル設定から
+        クライアントを取得するため、モデル自体はAPIキーに紐付かない。キャッシュは
+        現在のAPIキー1つ分に限り、キーが変わったら設定し直して全て破棄する。
+        """
         if not api_key:
             raise ValueError("API Key is required")
         
-        if self._model is None or self._api_key != api_key:
-            try:
+        try:
+            if self._api_key != api_key:
                 genai.configure(api_key=api_key)
-                self._model = genai.GenerativeModel(
+                self._models = {}
+                self._api_key = api_key
+            key = (model_name, temperature)
+            if key not in self._models:
+                self._models[key] = genai.GenerativeModel(
                     model_name,
-                    generation_config={"temperature": 0.0}
+                    generation_config={"temperature": temperature}
                 )
-                self._api_key = api_key
-            except Exception as e:
-                logger.error(f"Failed to initialize AI model: {e}")
-                raise
-        return self._model
+            return self._models[key]
+        except Exception as e:
+            logger.error(f"Failed to initialize AI model: {e}")
+            raise
 
 _ai_manager = AIModelManager()
 
 # =====================================================
 # シナリオ定義ヘルパー
 # =====================================================
-def _get_status_instructions(scenario_name: str) -> str:
-    if "電源" in scenario_name and "片系" in scenario_name:
-        return """
+# (シナリオ名に全て含まれるべきキーワード, 状態定義) を優先順に並べた表
+_SCENARIO_INSTRUCTIONS = (
+    (("電源", "片系"), """
 【状態定義: 電源冗長稼働中 (片系ダウン)】
 1. ハードウェアステータス: Power Supply 1: **Faulty / Failed**, Power Supply 2: **OK**
 2. サービス影響: なし (インターフェース UP, Ping 成功)
 3. エラーログ: 電源障害を示すSyslogまたはTrapを含めること。
-"""
-    elif "電源" in scenario_name and "両系" in scenario_name:
-        return """
+"""),
+    (("電源", "両系"), """
 【状態定義: 全電源喪失】
 1. ログ: "Connection Refused" または再起動直後のブートログのみ。
-"""
-    elif "FAN" in scenario_name:
-        return """
+"""),
+    (("FAN",), """
 【状態定義: ファン故障】
 1. ハードウェアステータス: Fan Tray 1 **Failure**
 2. 温度: 上昇中だが閾値内 (Warning)
 3. サービス影響: なし
-"""
-    elif "メモリ" in scenario_name:
-        return """
+"""),
+    (("メモリ",), """
 【状態定義: メモリリーク】
 1. メモリ使用率: **98%以上**
 2. プロセス: 特定のプロセス（例: SSHD, FlowMonitor等）が異常消費している様子を明確に示すこと。
 3. Syslog: メモリ割り当て失敗 (Malloc Fail) を含めること。
-"""
-    elif "BGP" in scenario_name:
-        return """
+"""),
+    (("BGP",), """
 【状態定義: BGPフラッピング】
 1. BGP状態: 特定のNeighborが Idle / Active を繰り返している。
 2. 物理IF: UP/UP
-"""
-    elif "全回線断" in scenario_name:
-        return """
+"""),
+    (("全回線断",), """
 【状態定義: 物理リンクダウン】
 1. 主要インターフェース: **DOWN / DOWN** (Carrier Loss)
 2. Ping: 100% Loss
-"""
+"""),
+)
+
+# 疑似ログ生成プロンプトのテンプレート
+_FAKE_LOG_PROMPT = """
+    あなたはネットワーク機器のCLIシミュレーターです。
+    シナリオ: {scenario_name}
+    対象機器: {hostname} ({vendor} {os_type})
+    {instructions}
+    出力ルール: 解説不要。CLIの生テキストのみ出力。
+    """
+
+def _get_status_instructions(scenario_name: str) -> str:
+    for keywords, instructions in _SCENARIO_INSTRUCTIONS:
+        if all(k in scenario_name for k in keywords):
+            return instructions
     return ""
 
 # =====================================================
@@ -140,18 +288,13 @@ def generate_fake_log_by_ai(scenario_name: str, target_node, api_key: str) -> st
     except Exception as e:
         return f"Error: {str(e)}"
     
-    vendor = target_node.metadata.get("vendor", "Unknown Vendor")
-    os_type = target_node.metadata.get("os", "Unknown OS")
-    hostname = target_node.id
-    instructions = _get_status_instructions(scenario_name)
-    
-    prompt = f"""
-    あなたはネットワーク機器のCLIシミュレーターです。
-    シナリオ: {scenario_name}
-    対象機器: {hostname} ({vendor} {os_type})
-    {instructions}
-    出力ルール: 解説不要。CLIの生テキストのみ出力。
-    """
+    prompt = _FAKE_LOG_PROMPT.format(
+        scenario_name=scenario_name,
+        hostname=target_node.id,
+        vendor=target_node.metadata.get("vendor", "Unknown Vendor"),
+        os_type=target_node.metadata.get("os", "Unknown OS"),
+        instructions=_get_status_instructions(scenario_name),
+    )
     
     for attempt in range(3):
         try:
@@ -204,22 +347,35 @@ def generate_health_check_commands(target_node, api_key):
 # =====================================================
 # 診断実行メイン関数
 # =====================================================
+def _demo_delay() -> float:
+    """デモ演出用の待ち時間（環境変数 AIOPS_DEMO_DELAY 秒。未設定なら待たない）"""
+    try:
+        return float(os.getenv("AIOPS_DEMO_DELAY") or 0)
+    except ValueError:
+        logger.warning("Invalid AIOPS_DEMO_DELAY value. Ignoring demo delay.")
+        return 0.0
+
 def run_diagnostic_simulation(scenario_type: str, target_node=None, api_key: str = None) -> dict:
-    time.sleep(1.5)
-    
     if "---" in scenario_type or "正常" in scenario_type:
         return {"status": "SKIPPED", "sanitized_log": "No action required.", "error": None}
+    
+    delay = _demo_delay()
+    if delay > 0:
+        time.sleep(delay)
 
     if "[Live]" in scenario_type:
-        commands = ["terminal length 0", "show version", "show interface brief", "show ip route"]
+        # ページングはnetmikoの接続時処理で無効化済み (terminal length 0 は不要)
+        commands = ["show version", "show interface brief", "show ip route"]
         try:
-            with ConnectHandler(**SANDBOX_DEVICE) as ssh:
-                if not ssh.check_enable_mode(): ssh.enable()
+            with _get_ssh(SANDBOX_DEVICE) as ssh:
                 prompt = ssh.find_prompt()
-                raw_output = f"Connected to: {prompt}\n"
+                # 取得済みのプロンプトを完了判定に使い、コマンド毎のプロンプト再検出を省く
+                expect_string = re.escape(prompt)
+                parts = ["Connected to: ", prompt, "\n"]
                 for cmd in commands:
-                    output = ssh.send_command(cmd)
-                    raw_output += f"\n{'='*30}\n[Command] {cmd}\n{output}\n"
+                    output = ssh.send_command(cmd, expect_string=expect_string)
+                    parts.extend((_SEP, cmd, "\n", output, "\n"))
+            raw_output = "".join(parts)
         except Exception as e:
             return {"status": "ERROR", "sanitized_log": "", "error": str(e)}
         return {"status": "SUCCESS", "sanitized_log": sanitize_output(raw_output), "error": None}
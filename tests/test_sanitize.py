@@ -0,0 +1,74 @@
+"""
+sanitize_output のマスキング結果の検証
+
+ルールは優先順に1つずつ適用される。重なり合うルールの結果は従来の
+逐次 re.sub と同じでなければならない（マスキング範囲が狭まらないこと）。
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network_ops import sanitize_output
+
+
+def test_x_api_key_header_uses_generic_token_rule():
+    # 汎用の api-key ルールが先に適用される
+    assert sanitize_output("x-api-key: abc123") == "x-api-key=<MASKED_TOKEN>"
+
+
+def test_username_secret_uses_generic_secret_rule():
+    # 汎用の secret ルールが先に適用され、値は隠される
+    assert (
+        sanitize_output("username admin privilege 15 secret 5 $1$abc")
+        == "username admin privilege 15 secret <HIDDEN_PASSWORD>"
+    )
+
+
+def test_encrypted_password_value_is_hidden():
+    assert sanitize_output("encrypted password 7 abcd") == "encrypted password <HIDDEN_PASSWORD>"
+    assert sanitize_output("encrypted password abcd") == "encrypted password <HIDDEN_PASSWORD>"
+
+
+def test_secret_after_token_keyword_is_hidden():
+    # 先に始まるトークン系のマッチが後続の password/secret を隠さないこと
+    assert sanitize_output("token: password 7 XYZ") == "token=<MASKED_TOKEN> <HIDDEN_PASSWORD>"
+    assert sanitize_output("x-api-key: secret 5 abc") == "x-api-key=<MASKED_TOKEN> <HIDDEN_PASSWORD>"
+    assert (
+        sanitize_output("Authorization: Bearer secret 5 foo")
+        == "Authorization: Bearer <MASKED_TOKEN> <HIDDEN_PASSWORD>"
+    )
+    assert sanitize_output("serial: password 7 abc") == "serial=<MASKED_SERIAL> <HIDDEN_PASSWORD>"
+
+
+def test_overlapping_token_rules_unchanged():
+    assert sanitize_output("Authorization: Bearer abc.def") == "Authorization: Bearer <MASKED_TOKEN>"
+    assert sanitize_output("token: 8.8.8.8") == "token=<MASKED_TOKEN>"
+    assert sanitize_output("api_key=abc.def-1") == "api_key=<MASKED_TOKEN>"
+
+
+def test_credentials_and_serials():
+    assert sanitize_output("enable secret 5 $1$abc") == "enable secret <HIDDEN_PASSWORD>"
+    assert sanitize_output("password 7 0822455D0A16") == "password <HIDDEN_PASSWORD>"
+    assert sanitize_output("snmp-server community public RO") == "snmp-server community <HIDDEN_COMMUNITY> RO"
+    assert sanitize_output("Serial Number: FOC1234X") == "Serial Number=<MASKED_SERIAL>"
+
+
+def test_public_ip_masked_private_ip_kept():
+    assert (
+        sanitize_output("neighbor 203.0.113.2 remote-as 64000")
+        == "neighbor <MASKED_PUBLIC_IP> remote-as 64000"
+    )
+    assert sanitize_output("10.0.0.1 172.16.5.4 192.168.0.1 127.0.0.1") == "10.0.0.1 172.16.5.4 192.168.0.1 127.0.0.1"
+    assert sanitize_output("172.32.1.1") == "<MASKED_PUBLIC_IP>"
+
+
+def test_public_ip_after_private_prefix_in_dotted_run_is_masked():
+    # 私設アドレスとして残したマッチの途中から始まる公開IPもマスクする
+    assert sanitize_output("10.8.8.8.8") == "10.<MASKED_PUBLIC_IP>"
+    assert sanitize_output("192.168.192.168.9") == "192.<MASKED_PUBLIC_IP>"
+    assert sanitize_output("172.16.8.8.8.8") == "172.<MASKED_PUBLIC_IP>.8"
+
+
+def test_text_without_sensitive_data_is_unchanged():
+    assert sanitize_output("No action required.") == "No action required."